@@ -1,10 +1,15 @@
-import requests as r
-from requests.models import Response
+import aiohttp
+from aiohttp import ClientResponse
+from yarl import URL
+import orjson
+import asyncio
+import shelve
 import sys
+from collections import Counter
+from functools import lru_cache
 import argparse
-from datetime import datetime
-import re as regex
-from typing import List, Union, Callable
+from datetime import datetime, timedelta
+from typing import List, Union, Callable, AsyncIterator, Tuple
 
 
 def create_parser():
@@ -15,6 +20,7 @@ def create_parser():
     parser.add_argument('-e', '--end', default=None)
     parser.add_argument('-b', '--branch', default='master')
     parser.add_argument('-t', '--token', default=None)
+    parser.add_argument('-c', '--cache', default=None)
     return parser
 
 
@@ -34,18 +40,23 @@ class GitHubAnalyzer:
 
     API_URL = 'https://api.github.com/repos'
     BASE_LINE = '=' * 80
+    PER_PAGE = 100  # Максимальный размер страницы, который отдает GitHub API
+    MAX_CONNECTIONS = 10  # Количество одновременно открытых соединений с api.github.com
+    PAGES_PER_BATCH = MAX_CONNECTIONS  # Количество страниц, запрашиваемых и хранящихся в памяти одновременно
 
     def __init__(self, url: str,
                  start: datetime,
                  end: datetime,
                  branch: str,
-                 token: Union[str, None]):
+                 token: Union[str, None],
+                 cache: Union[str, None] = None):
         """
         :param url: Адрес репозитория
         :param start: Дата начала анализа
         :param end: Дата конца анализа
         :param branch: Имя анализируемой ветки
         :param token: Токен доступа к github
+        :param cache: Путь к файлу кэша ответов GitHub, None или пустая строка, если кэш не используется
         """
         self.user, self.rep = GitHubAnalyzer.get_params_by_url(url)
         self.base_url = f'{GitHubAnalyzer.API_URL}/{self.user}/{self.rep}'
@@ -53,9 +64,13 @@ class GitHubAnalyzer:
         self.end: datetime = end
         self.branch: str = branch
 
-        self.session = r.Session()
+        self.headers = {}
         if token is not None:
-            self.session.headers['Authorization'] = 'token %s' % token
+            self.headers['Authorization'] = f'token {token}'
+        self.session: Union[aiohttp.ClientSession, None] = None
+        self.cache_path = cache
+        self.cache: Union[shelve.Shelf, None] = None
+        self._issues_cache: Union[asyncio.Future, None] = None
 
         print(GitHubAnalyzer.BASE_LINE)
         print('| repo = %-20s user = %-20s branch = %-20s' % (self.rep, self.user, self.branch))
@@ -65,37 +80,133 @@ class GitHubAnalyzer:
         ))
         print(GitHubAnalyzer.BASE_LINE)
 
+    async def __aenter__(self) -> 'GitHubAnalyzer':
+        """
+        Открытие HTTP сессии, общей для всех запросов анализатора. Параллельные запросы
+        распределяются по ограниченному пулу keep-alive соединений, чтобы не выполнять
+        TCP и TLS рукопожатие для каждой страницы
+        """
+        self.session = aiohttp.ClientSession(
+            headers=self.headers,
+            connector=aiohttp.TCPConnector(limit_per_host=GitHubAnalyzer.MAX_CONNECTIONS),
+        )
+        if self.cache_path:
+            self.cache = shelve.open(self.cache_path)
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        """Закрытие HTTP сессии и кэша ответов"""
+        await self.session.close()
+        if self.cache is not None:
+            self.cache.close()
+
     @staticmethod
-    def get_error_or_json(response: Response) -> List[dict]:
+    async def get_error_or_json(response: ClientResponse) -> Union[List[dict], dict]:
         """
         :param response: Ответ на GET запрос
         :return: Если ответ корректен, возвращает json обьект, иначе вызывает исключение
         """
-        if response.status_code != 200:
+        if response.status != 200:
             raise AnalyseException(
-                f'При выполнении запроса {response.request} произошла ошибка.\n'
-                f'Код ответа: {response.status_code}\n'
+                f'При выполнении запроса {response.method} {response.url} произошла ошибка.\n'
+                f'Код ответа: {response.status}\n'
                 f'\n'
-                f'{response.json()}'
+                f'{await response.text()}'
             )
-        return response.json()
+        return orjson.loads(await response.read())
+
+    @staticmethod
+    def get_last_page(response: ClientResponse) -> int:
+        """
+        :param response: Ответ на GET запрос
+        :return: Номер последней страницы из заголовка Link или 1, если страница всего одна
+        """
+        last = response.links.get('last')
+        if last is None:
+            return 1
+        return int(URL(last['url']).query.get('page', 1))
+
+    async def get_json(self, url: str) -> Tuple[Union[List[dict], dict], int]:
+        """
+        Если ответ на запрос уже есть в кэше, запрос выполняется с заголовком If-None-Match.
+        Для неизмененных данных GitHub возвращает 304 Not Modified без тела ответа, такие
+        ответы не расходуют лимит запросов
+
+        :param url: Адрес запроса
+        :return: json обьект ответа и номер последней страницы из заголовка Link
+        """
+        cached = self.cache.get(url) if self.cache is not None else None
+        headers = {'If-None-Match': cached[0]} if cached is not None else None
+        async with self.session.get(url, headers=headers) as response:
+            if response.status == 304 and cached is not None:
+                return cached[1], cached[2]
+            data = await GitHubAnalyzer.get_error_or_json(response)
+            last_page = GitHubAnalyzer.get_last_page(response)
+            etag = response.headers.get('ETag')
+        if self.cache is not None and etag is not None:
+            self.cache[url] = (etag, data, last_page)
+        return data, last_page
 
-    def show_top_commits(self) -> None:
-        """Вывод на экран 30 самых активных участников"""
+    async def get_page(self, url: str, page: int) -> List[dict]:
+        """
+        :param url: Адрес запроса без номера страницы
+        :param page: Номер страницы
+        :return: Элементы указанной страницы
+        """
+        return (await self.get_json(f'{url}&page={page}'))[0]
+
+    async def iter_pages(
+            self,
+            url: str,
+            stop: Union[Callable[[dict], bool], None] = None
+    ) -> AsyncIterator[List[dict]]:
+        """
+        Первая страница запрашивается отдельно, чтобы узнать количество страниц из заголовка Link,
+        остальные страницы запрашиваются параллельно пачками по PAGES_PER_BATCH, поэтому в памяти
+        одновременно находится не больше одной пачки. Если задано условие остановки, обход
+        прекращается после первой пачки, последний элемент которой ему удовлетворяет
+
+        :param url: Адрес запроса без номера страницы
+        :param stop: Условие остановки для последнего полученного элемента или None, если нужны все страницы
+        :return: Асинхронный итератор по страницам в порядке их номеров
+        """
+        items, last_page = await self.get_json(f'{url}&page=1')
+        yield items
+        page = 2
+        while page <= last_page and not (stop is not None and len(items) > 0 and stop(items[-1])):
+            pages = await asyncio.gather(*[
+                self.get_page(url, p) for p in range(page, min(page + GitHubAnalyzer.PAGES_PER_BATCH, last_page + 1))
+            ])
+            for items in pages:
+                yield items
+            page += GitHubAnalyzer.PAGES_PER_BATCH
+
+    @staticmethod
+    def show_top_commits(top_commits: List[dict]) -> None:
+        """
+        Вывод на экран 30 самых активных участников
+
+        :param top_commits: Список самых активных участников, см. get_top_commits
+        """
         print(GitHubAnalyzer.BASE_LINE)
         print('%3s  %-30s | %3s' % ('N', 'Name', 'Count'))
-        for index, item in enumerate(self.get_top_commits(), 1):
+        for index, item in enumerate(top_commits, 1):
             print('%3d. %-30s | %3d' % (index, item['name'], item['count']))
         print(GitHubAnalyzer.BASE_LINE)
 
-    def show_pr_info(self) -> None:
-        """Вывод информации о Pull Requests на экран"""
-        pulls = self.get_pull_requests()
-        closed_pulls_n = len(list(filter(lambda pull: pull['state'] != 'open', pulls)))
-        old_pulls_n = len(list(filter(
-            lambda pull: (datetime.today() - pull['created_at']).days > 30 and pull['state'] == 'open', pulls
-        )))
-        self.print_info(len(pulls) - closed_pulls_n, closed_pulls_n, old_pulls_n, 'PR')
+    async def get_pr_info(self) -> Tuple[int, int, int]:
+        """
+        :return: Количество открытых, закрытых и устаревших Pull Requests
+        """
+        if self.branch is None:
+            return (await self.get_issues_stats())[0]
+        stats = [0, 0, 0]
+        cutoff = datetime.today() - timedelta(days=31)
+        async for pull in self.iter_created_in_period(
+                f'{self.base_url}/pulls?state=all&base={self.branch}&per_page={GitHubAnalyzer.PER_PAGE}'
+        ):
+            GitHubAnalyzer.add_to_stats(stats, pull, cutoff)
+        return tuple(stats)
 
     @staticmethod
     def print_info(open_n: int, close_n: int, old_n: int, name: str) -> None:
@@ -111,37 +222,81 @@ class GitHubAnalyzer:
               f'| Old {name} = {old_n}')
         print(GitHubAnalyzer.BASE_LINE)
 
-    def get_issues_by_param(self, url: str, param: str):
-        page = 1
-        issues = []
-        while True:
-            tmp = GitHubAnalyzer.get_error_or_json(
-                self.session.get(f'{url}state={param}&page={page}&per_page=1000'))
-            if len(tmp) == 0:
-                break
-            issues += list(filter(
-                lambda issue: GitHubAnalyzer.compare_dates(
-                    self.end, GitHubAnalyzer.get_input_date_by_format(issue['created_at']),
-                    lambda d1, d2: d1 > d2
-                ), tmp
-            ))
-            page += 1
-        return issues
-
-    def show_issues_info(self) -> None:
-        """Вывод информации о Issues на экран"""
-        url = f'{self.base_url}/issues?'
+    @staticmethod
+    def add_to_stats(stats: List[int], item: dict, cutoff: datetime) -> None:
+        """
+        :param stats: Количество открытых, закрытых и устаревших элементов, изменяется на месте
+        :param item: Запись об Issue или Pull Request, см. iter_created_in_period
+        :param cutoff: Открытые элементы, созданные не позже этой даты, считаются устаревшими
+        """
+        if item['state'] != 'open':
+            stats[1] += 1
+            return
+        stats[0] += 1
+        if item['created_at'] <= cutoff:
+            stats[2] += 1
+
+    async def get_issues_stats(self) -> Tuple[Tuple[int, int, int], Tuple[int, int, int]]:
+        """
+        GitHub считает каждый Pull Request также и Issue, поэтому один обход /issues
+        используется и для Issues, и для Pull Requests. Обход запускается один раз, даже
+        если статистика одновременно запрашивается из get_pr_info и get_issues_info
+
+        :return: Количество открытых, закрытых и устаревших Pull Requests и Issues
+        """
+        if self._issues_cache is None:
+            self._issues_cache = asyncio.ensure_future(self.load_issues_stats())
+        return await self._issues_cache
+
+    async def load_issues_stats(self) -> Tuple[Tuple[int, int, int], Tuple[int, int, int]]:
+        """
+        :return: Количество открытых, закрытых и устаревших Pull Requests и Issues
+        """
+        url = f'{self.base_url}/issues?state=all&per_page={GitHubAnalyzer.PER_PAGE}'
         if self.start is not None:
-            url += f'since={self.start.strftime("%Y-%m-%d")}&'
-        close_issues = self.get_issues_by_param(url, 'closed')
-        open_issues = self.get_issues_by_param(url, 'open')
-        issues = open_issues + close_issues
-        close_n = len(close_issues)
-        old_pulls_n = len(list(filter(
-            lambda issue: (datetime.today() - GitHubAnalyzer.get_input_date_by_format(issue['created_at'])).days > 14,
-            open_issues
-        )))
-        self.print_info(len(issues) - close_n, close_n, old_pulls_n, 'Issues')
+            url += f'&since={GitHubAnalyzer.get_api_date(self.start)}'
+        pulls, issues = [0, 0, 0], [0, 0, 0]
+        today = datetime.today()
+        pr_cutoff, issue_cutoff = today - timedelta(days=31), today - timedelta(days=15)
+        async for item in self.iter_created_in_period(url):
+            if item['pull_request'] is not None:
+                GitHubAnalyzer.add_to_stats(pulls, item, pr_cutoff)
+            else:
+                GitHubAnalyzer.add_to_stats(issues, item, issue_cutoff)
+        return tuple(pulls), tuple(issues)
+
+    async def iter_created_in_period(self, url: str) -> AsyncIterator[dict]:
+        """
+        GitHub отдает Issues и Pull Requests в порядке убывания даты создания, поэтому обход прекращается
+        на первой странице, содержащей элемент старше даты начала анализа.
+        Дата создания разбирается один раз и сохраняется в записи как datetime
+
+        :param url: Адрес запроса /issues или /pulls без номера страницы
+        :return: Асинхронный итератор по записям об элементах, созданных в период анализа. Поле
+                 pull_request заполняется только для Pull Requests из ответа /issues
+        """
+        def created_before_start(item: dict) -> bool:
+            return GitHubAnalyzer.get_input_date_by_format(item['created_at']) <= self.start
+
+        async for page in self.iter_pages(url, created_before_start if self.start is not None else None):
+            for item in page:
+                created = GitHubAnalyzer.get_input_date_by_format(item['created_at'])
+                if (created is None
+                        or (self.start is not None and self.start >= created)
+                        or (self.end is not None and self.end <= created)):
+                    continue
+                yield {
+                    'number': item['number'],
+                    'created_at': created,
+                    'state': item['state'],
+                    'pull_request': item.get('pull_request'),
+                }
+
+    async def get_issues_info(self) -> Tuple[int, int, int]:
+        """
+        :return: Количество открытых, закрытых и устаревших Issues
+        """
+        return (await self.get_issues_stats())[1]
 
     @staticmethod
     def get_params_by_url(url: str) -> List[str]:
@@ -156,109 +311,91 @@ class GitHubAnalyzer:
                 f'извлечь имя пользователя и название репозитория')
         return params
 
-    @staticmethod
-    def compare_dates(
-            my_date: Union[datetime, None],
-            date: Union[datetime, None],
-            func: Callable[[datetime, datetime], bool]
-    ) -> bool:
+    def get_commits_url(self) -> str:
         """
-        :param my_date: Дата начала или конца анализа, None если анализ не ограничен
-        :param date: Какая то другая дата или None
-        :param func: функция для сравнения дат
-        :return: результат сравнения дат при помощи функции func
+        Даты начала и конца анализа не входят в период, как и для Issues и Pull Requests,
+        поэтому since указывает на начало следующего за датой начала дня
+
+        :return: Адрес запроса коммитов анализируемой ветки за период анализа без номера страницы
         """
-        if my_date is None:
-            return True
-        if date is None:
-            return False
-        return func(my_date, date)
+        url = f'{self.base_url}/commits?per_page={GitHubAnalyzer.PER_PAGE}'
+        if self.branch is not None:
+            url += f'&sha={self.branch}'
+        if self.start is not None:
+            url += f'&since={GitHubAnalyzer.get_api_date(self.start + timedelta(days=1))}'
+        if self.end is not None:
+            url += f'&until={GitHubAnalyzer.get_api_date(self.end)}'
+        return url
 
-    def get_top_commits(self) -> List:
+    async def get_top_commits(self) -> List:
         """
         :return: Список 30 самых активных пользователей в порядке убывания
         """
-        url = f'{self.base_url}/commits?per_page=1000'
-        if self.branch is not None:
-            url += f'&sha={self.branch}'
-        commits = GitHubAnalyzer.get_error_or_json(self.session.get(url))
-        commits = list(filter(
-            lambda item: GitHubAnalyzer.compare_dates(
-                self.start, GitHubAnalyzer.get_input_date_by_format(item['commit']['committer']['date']),
-                lambda d1, d2: d1 < d2
-            ) and GitHubAnalyzer.compare_dates(
-                self.end, GitHubAnalyzer.get_input_date_by_format(item['commit']['committer']['date']),
-                lambda d1, d2: d1 > d2
-            ),
-            commits
-        ))
-        authors = [f"{c['commit']['author']['name']}" for c in commits]
-        return sorted(
-            [{'name': author, 'count': authors.count(author)} for author in set(authors)],
-            key=lambda x: -x['count']
-        )[:30]
-
-    def get_pull_requests(self) -> List:
-        """
-        :return: Список Pull Requests согласно настроек анализа
-        """
-        pulls = []
-        page = 1
-        while True:
-            new_pulls = GitHubAnalyzer.get_error_or_json(
-                self.session.get(f'{self.base_url}/pulls?page={page}&per_page=1000&state=all'))
-            if len(new_pulls) == 0:
-                break
-            new_pulls = list(filter(
-                lambda item: GitHubAnalyzer.compare_dates(
-                    self.start, GitHubAnalyzer.get_input_date_by_format(item['created_at']),
-                    lambda d1, d2: d1 < d2
-                ) and GitHubAnalyzer.compare_dates(
-                    self.end, GitHubAnalyzer.get_input_date_by_format(item['created_at']),
-                    lambda d1, d2: d1 > d2
-                ),
-                new_pulls
-            ))
-            for pull in new_pulls:
-                if self.branch is not None and pull['base']['ref'] != self.branch:
-                    continue
-                pulls.append({
-                    'number': pull['number'],
-                    'created_at': GitHubAnalyzer.get_input_date_by_format(pull['created_at']),
-                    'closed_at': GitHubAnalyzer.get_input_date_by_format(pull['closed_at']),
-                    'state': pull['state'],
-                })
-            page += 1
-        return pulls
+        counts = Counter()
+        async for commits in self.iter_pages(self.get_commits_url()):
+            counts.update(c['commit']['author']['name'] for c in commits)
+        return [{'name': name, 'count': count} for name, count in counts.most_common(30)]
+
+    @staticmethod
+    def get_api_date(date: datetime) -> str:
+        """
+        :param date: Дата начала или конца анализа
+        :return: Дата в формате ISO 8601 (YYYY-MM-DDTHH:MM:SSZ), который принимают параметры since и until
+        """
+        return date.strftime('%Y-%m-%dT%H:%M:%SZ')
 
     @staticmethod
     def get_input_date_by_format(date: str) -> Union[datetime, None]:
         """
-        :param date: Дата, указанная в строковом формате
+        :param date: Дата в формате YYYY-MM-DD, в том числе в начале даты ISO 8601 из ответов GitHub
         :return: Объект datetime или None, если дата указана неверно или не указана
         """
-        if date is None:
+        try:
+            return GitHubAnalyzer.get_day_by_format(date[:10])
+        except TypeError:
             return None
-        x = regex.search(
-            r'(19|20)\d\d-((0[1-9]|1[012])-(0[1-9]|[12]\d)|(0[13-9]|1[012])-30|(0[13578]|1[02])-31)', date
-        )
-        return datetime.strptime(x.group(0), '%Y-%m-%d') if x is not None else None
 
+    @staticmethod
+    @lru_cache(maxsize=4096)
+    def get_day_by_format(day: str) -> Union[datetime, None]:
+        """
+        Результат кэшируется, так как у многих PR и Issues совпадает день создания
 
-if __name__ == '__main__':
+        :param day: Дата в формате YYYY-MM-DD без времени
+        :return: Объект datetime или None, если дата указана неверно
+        """
+        try:
+            if day[4] != '-' or day[7] != '-':
+                return None
+            result = datetime(int(day[0:4]), int(day[5:7]), int(day[8:10]))
+        except (ValueError, IndexError):
+            return None
+        return result if 1900 <= result.year < 2100 else None
+
+
+async def main() -> None:
     namespace = create_parser().parse_args(sys.argv[1:])
 
     s_date = GitHubAnalyzer.get_input_date_by_format(namespace.start)
     e_date = GitHubAnalyzer.get_input_date_by_format(namespace.end)
 
-    analyzer = GitHubAnalyzer(
+    async with GitHubAnalyzer(
         url=namespace.url,
         start=s_date,
         end=e_date,
-        branch=namespace.branch,
+        branch=namespace.branch or None,
         token=namespace.token,
-    )
+        cache=namespace.cache,
+    ) as analyzer:
+        top_commits, pr_info, issues_info = await asyncio.gather(
+            analyzer.get_top_commits(),
+            analyzer.get_pr_info(),
+            analyzer.get_issues_info(),
+        )
+    GitHubAnalyzer.show_top_commits(top_commits)
+    GitHubAnalyzer.print_info(*pr_info, 'PR')
+    GitHubAnalyzer.print_info(*issues_info, 'Issues')
 
-    analyzer.show_top_commits()
-    analyzer.show_pr_info()
-    analyzer.show_issues_info()
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -1,9 +1,22 @@
+import contextlib
+import io
+import os
+import tempfile
 import unittest
-from datetime import datetime
+from unittest import mock
+from datetime import datetime, timedelta
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
 
 from main import GitHubAnalyzer, AnalyseException
 
 
+def create_analyzer(start=None, end=None, branch='master', cache=None) -> GitHubAnalyzer:
+    with contextlib.redirect_stdout(io.StringIO()):
+        return GitHubAnalyzer('LucianDeveloper/GitHubAnalyzer', start, end, branch, None, cache)
+
+
 class TestDate(unittest.TestCase):
     def test_correct_date(self):
         self.assertEqual(GitHubAnalyzer.get_input_date_by_format('2020-10-10'), datetime(year=2020, month=10, day=10))
@@ -12,18 +25,29 @@ class TestDate(unittest.TestCase):
         self.assertEqual(GitHubAnalyzer.get_input_date_by_format('1234-10-10'), None)
         self.assertEqual(GitHubAnalyzer.get_input_date_by_format('2020-77-10'), None)
         self.assertEqual(GitHubAnalyzer.get_input_date_by_format('2020-10-77'), None)
+        self.assertEqual(GitHubAnalyzer.get_input_date_by_format('2021-02-29'), None)
+        self.assertEqual(GitHubAnalyzer.get_input_date_by_format('2020/10/10'), None)
+        self.assertEqual(GitHubAnalyzer.get_input_date_by_format(None), None)
+
+    def test_iso_date(self):
+        self.assertEqual(
+            GitHubAnalyzer.get_input_date_by_format('2020-02-29T12:30:00Z'),
+            datetime(year=2020, month=2, day=29)
+        )
+
+    def test_cache_by_day(self):
+        GitHubAnalyzer.get_day_by_format.cache_clear()
+        for timestamp in ('2020-10-10T12:00:01Z', '2020-10-10T13:00:02Z', '2020-10-10T14:00:03Z'):
+            self.assertEqual(GitHubAnalyzer.get_input_date_by_format(timestamp), datetime(year=2020, month=10, day=10))
+        info = GitHubAnalyzer.get_day_by_format.cache_info()
+        self.assertEqual((info.hits, info.misses), (2, 1))
 
     @unittest.expectedFailure
     def test_fail(self):
         self.assertRaises(AnalyseException, GitHubAnalyzer.get_input_date_by_format(1234578))
 
-    def test_date_compare(self):
-        date_1 = datetime(year=2020, month=10, day=10)
-        date_2 = datetime(year=2019, month=10, day=10)
-        self.assertFalse(GitHubAnalyzer.compare_dates(date_1, date_2, lambda d1, d2: d1 < d2))
-        self.assertFalse(GitHubAnalyzer.compare_dates(date_1, None, lambda d1, d2: d1 < d2))
-        self.assertTrue(GitHubAnalyzer.compare_dates(None, date_2, lambda d1, d2: d1 < d2))
-        self.assertTrue(GitHubAnalyzer.compare_dates(None, None, lambda d1, d2: d1 < d2))
+    def test_api_date(self):
+        self.assertEqual(GitHubAnalyzer.get_api_date(datetime(year=2020, month=10, day=10)), '2020-10-10T00:00:00Z')
 
 
 class TestUrlParams(unittest.TestCase):
@@ -50,5 +74,185 @@ class TestUrlParams(unittest.TestCase):
         )
 
 
+class TestCommitsUrl(unittest.TestCase):
+    def test_period_bounds(self):
+        analyzer = create_analyzer(
+            start=datetime(year=2020, month=10, day=10),
+            end=datetime(year=2020, month=10, day=20)
+        )
+        url = analyzer.get_commits_url()
+        self.assertIn('&since=2020-10-11T00:00:00Z', url)
+        self.assertIn('&until=2020-10-20T00:00:00Z', url)
+
+    def test_no_period(self):
+        url = create_analyzer().get_commits_url()
+        self.assertNotIn('since', url)
+        self.assertNotIn('until', url)
+
+
+class TestStats(unittest.IsolatedAsyncioTestCase):
+    cutoff = datetime(year=2020, month=10, day=10)
+    before_cutoff = datetime(year=2020, month=1, day=1)
+    after_cutoff = datetime(year=2020, month=12, day=1)
+
+    def test_closed(self):
+        stats = [0, 0, 0]
+        GitHubAnalyzer.add_to_stats(stats, {'state': 'closed', 'created_at': self.before_cutoff}, self.cutoff)
+        self.assertEqual(stats, [0, 1, 0])
+
+    def test_open_old(self):
+        stats = [0, 0, 0]
+        GitHubAnalyzer.add_to_stats(stats, {'state': 'open', 'created_at': self.before_cutoff}, self.cutoff)
+        self.assertEqual(stats, [1, 0, 1])
+
+    def test_open_new(self):
+        stats = [0, 0, 0]
+        GitHubAnalyzer.add_to_stats(stats, {'state': 'open', 'created_at': self.after_cutoff}, self.cutoff)
+        self.assertEqual(stats, [1, 0, 0])
+
+    def test_old_boundary(self):
+        # PR старый, если (today - created_at).days > 30
+        today = datetime(year=2020, month=11, day=9, hour=5)
+        cutoff = today - timedelta(days=31)
+        stats = [0, 0, 0]
+        item = {'state': 'open', 'created_at': datetime(year=2020, month=10, day=9)}
+        GitHubAnalyzer.add_to_stats(stats, item, cutoff)
+        self.assertEqual(stats, [1, 0, 1])
+        stats = [0, 0, 0]
+        item = {'state': 'open', 'created_at': datetime(year=2020, month=10, day=10)}
+        GitHubAnalyzer.add_to_stats(stats, item, cutoff)
+        self.assertEqual(stats, [1, 0, 0])
+
+    async def test_split_pulls_and_issues(self):
+        old = datetime.today() - timedelta(days=60)
+        records = [
+            {'number': 1, 'created_at': old, 'state': 'open', 'pull_request': {'url': 'pulls/1'}},
+            {'number': 2, 'created_at': old, 'state': 'closed', 'pull_request': {'url': 'pulls/2'}},
+            {'number': 3, 'created_at': old, 'state': 'open', 'pull_request': None},
+            {'number': 4, 'created_at': datetime.today(), 'state': 'open', 'pull_request': None},
+        ]
+
+        async def iter_created_in_period(url):
+            for record in records:
+                yield record
+
+        analyzer = create_analyzer()
+        analyzer.iter_created_in_period = iter_created_in_period
+        self.assertEqual(await analyzer.load_issues_stats(), ((1, 1, 1), (2, 0, 1)))
+
+
+class TestPullRequests(unittest.IsolatedAsyncioTestCase):
+    async def test_branch_uses_pulls(self):
+        today = datetime.today()
+        records = [
+            {'number': 1, 'created_at': today - timedelta(days=60), 'state': 'open', 'pull_request': None},
+            {'number': 2, 'created_at': today, 'state': 'open', 'pull_request': None},
+            {'number': 3, 'created_at': today, 'state': 'closed', 'pull_request': None},
+        ]
+        urls = []
+
+        async def iter_created_in_period(url):
+            urls.append(url)
+            for record in records:
+                yield record
+
+        analyzer = create_analyzer(branch='dev')
+        analyzer.iter_created_in_period = iter_created_in_period
+        self.assertEqual(await analyzer.get_pr_info(), (2, 1, 1))
+        self.assertEqual(len(urls), 1)
+        self.assertIn('/pulls?state=all&base=dev&', urls[0])
+
+    async def test_without_branch_uses_issues(self):
+        async def load_issues_stats():
+            return (3, 2, 1), (0, 0, 0)
+
+        analyzer = create_analyzer(branch=None)
+        analyzer.load_issues_stats = load_issues_stats
+        self.assertEqual(await analyzer.get_pr_info(), (3, 2, 1))
+
+
+class TestEarlyStop(unittest.IsolatedAsyncioTestCase):
+    async def collect(self, start):
+        # 6 страниц по 2 элемента, даты создания по убыванию: 2020-01-31 ... 2020-01-20
+        pages = [
+            [{'number': n, 'created_at': f'2020-01-{31 - n}T12:00:00Z', 'state': 'open'} for n in (2 * p, 2 * p + 1)]
+            for p in range(6)
+        ]
+        requested = []
+
+        async def get_json(url):
+            page = int(url.rsplit('page=', 1)[1])
+            requested.append(page)
+            return pages[page - 1], len(pages)
+
+        analyzer = create_analyzer(start=start)
+        analyzer.get_json = get_json
+        with mock.patch.object(GitHubAnalyzer, 'PAGES_PER_BATCH', 2):
+            numbers = [item['number'] async for item in analyzer.iter_created_in_period('/issues?state=all')]
+        return sorted(requested), numbers
+
+    async def test_stop_at_batch_end(self):
+        requested, numbers = await self.collect(datetime(year=2020, month=1, day=26))
+        self.assertEqual(requested, [1, 2, 3])
+        self.assertEqual(numbers, [0, 1, 2, 3, 4])
+
+    async def test_stop_inside_batch(self):
+        requested, numbers = await self.collect(datetime(year=2020, month=1, day=28))
+        self.assertEqual(requested, [1, 2, 3])
+        self.assertEqual(numbers, [0, 1, 2])
+
+    async def test_no_start(self):
+        requested, numbers = await self.collect(None)
+        self.assertEqual(requested, [1, 2, 3, 4, 5, 6])
+        self.assertEqual(numbers, list(range(12)))
+
+
+class TestCache(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.if_none_match = []
+
+        async def handler(request):
+            self.if_none_match.append(request.headers.get('If-None-Match'))
+            if request.headers.get('If-None-Match') == '"v1"':
+                return web.Response(status=304, headers={'ETag': '"v1"'})
+            return web.json_response([{'number': 1}], headers={
+                'ETag': '"v1"',
+                'Link': f'<{request.url.with_query(page=3)}>; rel="last"',
+            })
+
+        app = web.Application()
+        app.router.add_get('/items', handler)
+        self.server = TestServer(app)
+        await self.server.start_server()
+        self.cache_dir = tempfile.TemporaryDirectory()
+
+    async def asyncTearDown(self):
+        await self.server.close()
+        self.cache_dir.cleanup()
+
+    async def test_not_modified(self):
+        url = str(self.server.make_url('/items?page=1'))
+        cache = os.path.join(self.cache_dir.name, 'cache')
+        async with create_analyzer(cache=cache) as analyzer:
+            self.assertEqual(await analyzer.get_json(url), ([{'number': 1}], 3))
+        async with create_analyzer(cache=cache) as analyzer:
+            self.assertEqual(await analyzer.get_json(url), ([{'number': 1}], 3))
+        self.assertEqual(self.if_none_match, [None, '"v1"'])
+
+    async def test_without_cache(self):
+        url = str(self.server.make_url('/items?page=1'))
+        async with create_analyzer() as analyzer:
+            await analyzer.get_json(url)
+            await analyzer.get_json(url)
+        self.assertEqual(self.if_none_match, [None, None])
+
+    async def test_empty_cache_path(self):
+        url = str(self.server.make_url('/items?page=1'))
+        async with create_analyzer(cache='') as analyzer:
+            self.assertIsNone(analyzer.cache)
+            await analyzer.get_json(url)
+        self.assertEqual(self.if_none_match, [None])
+
+
 if __name__ == '__main__':
     unittest.main()